@@ -202,10 +202,18 @@ export class ChatbotStack extends cdk.Stack {
       actions: ['s3:GetObject', 's3:PutObject'],
       resources: [contentBucket.bucketArn, `${contentBucket.bucketArn}/*`],
     }));
+    lambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['s3:PutObject'], // Parquet files for Milvus bulk insert
+      resources: [`${milvusBucket.bucketArn}/bulk_insert/*`],
+    }));
     lambdaRole.addToPolicy(new iam.PolicyStatement({
       actions: ['secretsmanager:GetSecretValue'],
       resources: [openaiSecret.secretArn, googleSecret.secretArn],
     }));
+    lambdaRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['secretsmanager:BatchGetSecretValue'], // Does not support resource-level permissions
+      resources: ['*'],
+    }));
 
     // Lambda for Chat/STT/TTS
     const chatLambda = new lambda.Function(this, 'ChatLambda', {
@@ -219,6 +227,7 @@ export class ChatbotStack extends cdk.Stack {
         OPENAI_SECRET_ARN: openaiSecret.secretArn,
         GOOGLE_SECRET_ARN: googleSecret.secretArn,
         BUCKET_NAME: contentBucket.bucketName,
+        MILVUS_BULK_BUCKET: milvusBucket.bucketName,
       },
     });
 
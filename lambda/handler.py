@@ -1,10 +1,12 @@
-import json
+import orjson
+import io
+import base64
 import boto3
-from openai import OpenAI
-from google.cloud import texttospeech
-from pymilvus import connections, Collection, exceptions as milvus_exceptions
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import PyPDF2
+from botocore.exceptions import ClientError
+import httpx
+from openai import OpenAI, RateLimitError, APITimeoutError
+from pymilvus import connections, Collection, DataType, BulkInsertState, utility, exceptions as milvus_exceptions
+import numpy as np
 import os
 import time
 import signal
@@ -13,10 +15,16 @@ import http.server
 import socketserver
 import threading
 import pathlib
+import importlib
 import importlib.util
+import hashlib
+import mmap
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Import Milvus setup utilities
-from milvus_setup import create_milvus_collection
+from milvus_setup import create_milvus_collection, ensure_connection
 
 # Load .env file for local development
 try:
@@ -30,6 +38,16 @@ try:
 except ImportError:
     print("python-dotenv not installed, using environment variables")
 
+# Heavy modules are imported on first use so health checks don't pay for them
+_lazy_modules = {}
+
+def lazy_import(name):
+    """Import a module by name once and cache it"""
+    module = _lazy_modules.get(name)
+    if module is None:
+        module = _lazy_modules[name] = importlib.import_module(name)
+    return module
+
 # Initialize AWS clients
 s3 = boto3.client('s3')
 secrets_client = boto3.client('secretsmanager')
@@ -39,16 +57,49 @@ openai_client = None
 google_tts = None
 collection = None
 embedder = None
+# Embedding backend reported by health checks, set alongside embedder in init()
+embedding_type = "None"
 
 # Flag to track initialization status
 is_initialized = False
 
+# Embedding batch limits (approximate tokens per request and concurrent requests)
+BATCH_TOKENS = int(os.getenv('EMBEDDING_BATCH_TOKENS', 8000))
+BATCH_WORKERS = int(os.getenv('EMBEDDING_BATCH_WORKERS', 4))
+BATCH_RETRY_DELAY = 2  # seconds to back off before retrying throttled batches
+
+# Content-addressed embedding cache on Lambda ephemeral storage, optionally mirrored to S3
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', '/tmp/emb_cache')
+EMBEDDING_CACHE_PREFIX = os.getenv('EMBEDDING_CACHE_PREFIX')  # e.g. "emb_cache/" in BUCKET_NAME
+# Oldest local entries are pruned past this size so warm containers don't fill /tmp
+EMBEDDING_CACHE_MAX_MB = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 256))
+
+# PDFs with more chunks than this are loaded via Milvus bulk insert instead of streaming insert
+BULK_INSERT_THRESHOLD = int(os.getenv('MILVUS_BULK_INSERT_THRESHOLD', 1000))
+# Milvus only imports files from its own object storage bucket; bulk insert is disabled when unset
+MILVUS_BULK_BUCKET = os.getenv('MILVUS_BULK_BUCKET')
+BULK_INSERT_TIMEOUT = int(os.getenv('MILVUS_BULK_INSERT_TIMEOUT', 20))  # seconds
+BULK_WRITER_DIR = '/tmp/bulk_writer'
+
+# Chunk size and overlap in tokens; ~256 tokens matches the previous 1000-character chunks
+# and stays within bge-base-en's 512-token input limit
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', 256))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 50))
+
+# Chunks embedded and inserted per batch on the streaming insert path
+INSERT_BATCH_SIZE = int(os.getenv('MILVUS_INSERT_BATCH_SIZE', 256))
+
+# Threads used to extract text from PDF pages
+PDF_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
 # Simple fallback embedding class when HuggingFace isn't available
 class DummyEmbedder:
     """
     Fallback embedder that uses OpenAI for embeddings when HuggingFace isn't available.
     This ensures the service can still function without the local embedding model.
     """
+    model_name = "text-embedding-3-small"
+
     def __init__(self, openai_client):
         self.openai_client = openai_client
         print("Using OpenAI embeddings as fallback")
@@ -57,7 +108,7 @@ class DummyEmbedder:
         if not self.openai_client:
             raise ValueError("OpenAI client not initialized")
         response = self.openai_client.embeddings.create(
-            model="text-embedding-3-small",
+            model=self.model_name,
             input=text
         )
         return response.data[0].embedding
@@ -65,11 +116,53 @@ class DummyEmbedder:
     def embed_documents(self, texts):
         if not self.openai_client:
             raise ValueError("OpenAI client not initialized")
+        batches = self._batch_texts(texts)
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        # Submit batches concurrently and collect results in input order
+        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(batches))) as executor:
+            futures = [executor.submit(self._embed_batch, batch) for batch in batches]
+        results = []
+        backed_off = False
+        for batch, future in zip(batches, futures):
+            try:
+                results.append(future.result())
+            except (RateLimitError, APITimeoutError) as e:
+                # Retry only the throttled batches, one at a time, after backing off once
+                print(f"Embedding batch failed ({str(e)}), retrying sequentially")
+                if not backed_off:
+                    time.sleep(BATCH_RETRY_DELAY)
+                    backed_off = True
+                results.append(self._embed_batch(batch))
+        return np.concatenate(results)
+
+    def _embed_batch(self, texts):
+        # Request raw base64 floats and decode them straight into a float32 array
         response = self.openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=texts
+            model=self.model_name,
+            input=texts,
+            encoding_format="base64"
         )
-        return [item.embedding for item in response.data]
+        return np.stack([np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+                         for item in response.data])
+
+    @staticmethod
+    def _batch_texts(texts):
+        """Greedily pack texts into batches under BATCH_TOKENS (estimated at 4 chars per token)"""
+        batches = []
+        current, current_tokens = [], 0
+        for text in texts:
+            tokens = len(text) // 4
+            if current and current_tokens + tokens > BATCH_TOKENS:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
 
 # Try to import HuggingFaceEmbeddings
 hf_embeddings_available = False
@@ -82,9 +175,57 @@ except ImportError as e:
     print(f"WARNING: Unable to import embedding modules: {str(e)}")
     print("Will use OpenAI embeddings as fallback if OpenAI is available")
 
+# HuggingFace model is loaded at most once per container
+_embedder_lock = threading.Lock()
+_embedder_singleton = None
+
+def get_hf_embedder():
+    """Return the shared HuggingFace embeddings model, loading it on first use"""
+    global _embedder_singleton
+    if _embedder_singleton is None:
+        with _embedder_lock:
+            if _embedder_singleton is None:
+                print("Initializing HuggingFace embeddings model")
+                _embedder_singleton = HuggingFaceEmbeddings(model_name='BAAI/bge-base-en')
+                print("HuggingFace embeddings model ready")
+    return _embedder_singleton
+
+def make_openai_client(api_key):
+    """Create an OpenAI client whose HTTP/2 connection pool is shared by all requests,
+    so concurrent embedding batches are multiplexed over one TLS connection"""
+    http_client = httpx.Client(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    )
+    return OpenAI(api_key=api_key, http_client=http_client)
+
+# Secrets are fetched once per container and reused by later init() calls
+_secrets = None
+
+def get_secrets(openai_secret_arn, google_secret_arn):
+    """Fetch the OpenAI and Google keys from Secrets Manager in a single round-trip"""
+    global _secrets
+    if _secrets is None:
+        response = secrets_client.batch_get_secret_value(SecretIdList=[openai_secret_arn, google_secret_arn])
+        if response.get('Errors'):
+            raise RuntimeError(f"Failed to retrieve secrets: {response['Errors']}")
+        values = {}
+        for secret in response['SecretValues']:
+            values[secret['ARN']] = values[secret['Name']] = secret['SecretString']
+        _secrets = (values[openai_secret_arn], values[google_secret_arn])
+    return _secrets
+
+def write_google_credentials(google_key, path='/tmp/google_credentials.json'):
+    """Write the Google service account key once per container"""
+    if not os.path.exists(path):
+        with open(path, 'w') as f:
+            f.write(google_key)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = path
+
 def init():
     """Initialize connections and clients with graceful error handling"""
-    global openai_client, google_tts, collection, embedder, is_initialized
+    global openai_client, google_tts, collection, embedder, embedding_type, is_initialized
     
     # Initialize OpenAI client first as it may be needed for fallback embeddings
     try:
@@ -93,21 +234,18 @@ def init():
         google_secret_arn = os.getenv('GOOGLE_SECRET_ARN')
         
         if openai_secret_arn and google_secret_arn:
-            openai_key = secrets_client.get_secret_value(SecretId=openai_secret_arn)['SecretString']
-            google_key = secrets_client.get_secret_value(SecretId=google_secret_arn)['SecretString']
+            openai_key, google_key = get_secrets(openai_secret_arn, google_secret_arn)
             
             # In local dev, fall back to environment variables if secrets can't be retrieved
-            openai_client = OpenAI(api_key=openai_key)
+            openai_client = make_openai_client(openai_key)
             
             # Set up Google credentials
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '/tmp/google_credentials.json'
-            with open('/tmp/google_credentials.json', 'w') as f:
-                f.write(google_key)
-            google_tts = texttospeech.TextToSpeechClient()
+            write_google_credentials(google_key)
+            google_tts = lazy_import('google.cloud.texttospeech').TextToSpeechClient()
         else:
             # Local development fallback
             print("Secrets ARNs not found, using local environment variables")
-            openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            openai_client = make_openai_client(os.getenv('OPENAI_API_KEY'))
             
             # Set up Google credentials for local development
             google_creds_path = os.getenv('GOOGLE_API_KEY')
@@ -124,7 +262,7 @@ def init():
             
             # Initialize Google TTS client
             try:
-                google_tts = texttospeech.TextToSpeechClient()
+                google_tts = lazy_import('google.cloud.texttospeech').TextToSpeechClient()
                 print("Successfully initialized Google TTS client")
             except Exception as e:
                 print(f"Error initializing Google TTS client: {str(e)}")
@@ -135,9 +273,10 @@ def init():
             # Milvus Connection
             milvus_host = os.getenv('MILVUS_HOST', 'localhost')
             milvus_port = os.getenv('MILVUS_PORT', '19530')
+            expected_size = int(os.getenv('MILVUS_EXPECTED_SIZE', 10000))
             
             print("Initializing Milvus collection")
-            collection = create_milvus_collection(milvus_host, milvus_port)
+            collection = create_milvus_collection(milvus_host, milvus_port, expected_size=expected_size)
             print("Milvus collection ready")
         except Exception as e:
             print(f"Error setting up Milvus collection: {str(e)}")
@@ -145,9 +284,7 @@ def init():
         # Initialize embedding model with fallback strategy
         if hf_embeddings_available:
             try:
-                print("Initializing HuggingFace embeddings model")
-                embedder = HuggingFaceEmbeddings(model_name='BAAI/bge-base-en')
-                print("HuggingFace embeddings model ready")
+                embedder = get_hf_embedder()
             except Exception as e:
                 print(f"Error initializing HuggingFace embeddings model: {str(e)}")
                 if openai_client:
@@ -164,6 +301,14 @@ def init():
                 print("No embedding service available")
                 embedder = None
         
+        # Load the chunking tokenizer now so its BPE download isn't paid by the first upload
+        try:
+            get_tokenizer()
+        except Exception as e:
+            print(f"Error loading tokenizer: {str(e)}")
+
+        embedding_type = "OpenAI fallback" if isinstance(embedder, DummyEmbedder) else \
+                         "HuggingFace" if embedder else "None"
         is_initialized = True
         print("Initialization complete")
     except Exception as e:
@@ -177,7 +322,7 @@ def connect_to_milvus(host, port, max_retries=5):
     retries = 0
     while retries < max_retries:
         try:
-            connections.connect(host=host, port=port)
+            ensure_connection(host, port)
             collection = Collection('docs')  # Precreated via milvus_setup.py
             print(f"Successfully connected to Milvus at {host}:{port}")
             return True
@@ -189,18 +334,403 @@ def connect_to_milvus(host, port, max_retries=5):
                 return False
             time.sleep(3)  # Wait before retrying
 
+def _cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\n{text}".encode()).hexdigest()
+
+def _load_cached_embedding(cache_key):
+    """Look up an embedding in the local cache"""
+    path = os.path.join(EMBEDDING_CACHE_DIR, f"{cache_key}.npy")
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+    return None
+
+def _store_cached_embedding(cache_key, embedding):
+    path = os.path.join(EMBEDDING_CACHE_DIR, f"{cache_key}.npy")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.asarray(embedding, dtype=np.float32))
+    os.replace(tmp_path, path)
+    return path
+
+def _prune_embedding_cache(max_bytes=None):
+    """Delete the least recently written local cache entries until the cache fits in max_bytes"""
+    if max_bytes is None:
+        max_bytes = EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    total = 0
+    with os.scandir(EMBEDDING_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+# Log S3 AccessDenied on the cache mirror once per container rather than on every miss
+_cache_access_denied_logged = False
+
+def _load_cached_batch(bucket, batch_key):
+    """Fetch a batch of embeddings from the S3 mirror as {cache_key: vector}"""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=f"{EMBEDDING_CACHE_PREFIX}{batch_key}.npz")['Body'].read()
+    except ClientError as e:
+        global _cache_access_denied_logged
+        code = e.response['Error']['Code']
+        if code in ('NoSuchKey', '404'):
+            return {}
+        # Without s3:ListBucket a missing key is reported as AccessDenied rather than NoSuchKey,
+        # but the same error also means a missing s3:GetObject grant, so don't hide it entirely
+        if code in ('AccessDenied', '403'):
+            if not _cache_access_denied_logged:
+                print(f"Embedding cache read denied for s3://{bucket}/{EMBEDDING_CACHE_PREFIX}: {str(e)}. "
+                      "Treating as a miss; check s3:GetObject and s3:ListBucket on the cache prefix")
+                _cache_access_denied_logged = True
+            return {}
+        raise
+    with np.load(io.BytesIO(body)) as data:
+        return dict(zip(data['keys'].tolist(), data['vectors']))
+
+def _store_cached_batch(bucket, batch_key, keys, embeddings):
+    """Upload a batch of embeddings to the S3 mirror as a single object"""
+    buffer = io.BytesIO()
+    np.savez(buffer, keys=np.array(keys), vectors=embeddings)
+    s3.put_object(Bucket=bucket, Key=f"{EMBEDDING_CACHE_PREFIX}{batch_key}.npz", Body=buffer.getvalue())
+
+def cached_embed(chunks):
+    """Embed chunks, reusing cached embeddings keyed by SHA-256 of model name and text.
+    Returns a contiguous float32 array with one row per chunk.
+
+    Entries are cached per chunk on local ephemeral storage, pruned oldest first past EMBEDDING_CACHE_MAX_MB.
+    When EMBEDDING_CACHE_PREFIX is set, the whole batch is also mirrored to S3 as one object,
+    costing at most one GET and one PUT per call."""
+    model_name = getattr(embedder, 'model_name', type(embedder).__name__)
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+
+    keys = [_cache_key(model_name, chunk) for chunk in chunks]
+    cached = {}
+    for i, cache_key in enumerate(keys):
+        try:
+            vector = _load_cached_embedding(cache_key)
+        except Exception as e:
+            print(f"Embedding cache read error: {str(e)}")
+            vector = None
+        if vector is not None:
+            cached[i] = vector
+
+    written = 0
+    bucket = os.getenv('BUCKET_NAME') if EMBEDDING_CACHE_PREFIX else None
+    batch_key = hashlib.sha256(''.join(keys).encode()).hexdigest()
+    if bucket and len(cached) < len(chunks):
+        try:
+            remote = _load_cached_batch(bucket, batch_key)
+        except Exception as e:
+            print(f"Embedding cache read error: {str(e)}")
+            remote = {}
+        for i, cache_key in enumerate(keys):
+            if i not in cached and cache_key in remote:
+                cached[i] = remote[cache_key]
+                try:
+                    _store_cached_embedding(cache_key, remote[cache_key])
+                    written += 1
+                except Exception as e:
+                    print(f"Embedding cache write error: {str(e)}")
+
+    misses = [i for i in range(len(chunks)) if i not in cached]
+    computed = None
+    if misses:
+        print(f"Embedding cache: {len(cached)} hits, {len(misses)} misses")
+        computed = np.asarray(embedder.embed_documents([chunks[i] for i in misses]), dtype=np.float32)
+
+    if computed is not None:
+        dim = computed.shape[1]
+    elif cached:
+        dim = len(next(iter(cached.values())))
+    else:
+        dim = 0
+    embeddings = np.empty((len(chunks), dim), dtype=np.float32)
+    for i, vector in cached.items():
+        embeddings[i] = vector
+
+    if misses:
+        embeddings[misses] = computed
+        for i, embedding in zip(misses, computed):
+            try:
+                _store_cached_embedding(keys[i], embedding)
+                written += 1
+            except Exception as e:
+                print(f"Embedding cache write error: {str(e)}")
+        if bucket:
+            try:
+                _store_cached_batch(bucket, batch_key, keys, embeddings)
+            except Exception as e:
+                print(f"Embedding cache upload error: {str(e)}")
+
+    if written:
+        try:
+            _prune_embedding_cache()
+        except Exception as e:
+            print(f"Embedding cache prune error: {str(e)}")
+    return embeddings
+
+def as_vectors(embeddings):
+    """L2-normalize embeddings and cast them to the numpy dtype of the collection's vector field.
+    float32 arrays are normalized in place; rows are returned as views of one contiguous array."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    vector_field = next(f for f in collection.schema.fields if f.name == 'embeddings')
+    dtype = np.float16 if vector_field.dtype == DataType.FLOAT16_VECTOR else np.float32
+    return list(vectors.astype(dtype, copy=False))
+
+# Search params follow the metric each collection was indexed with
+_search_params = {}
+
+def search_params():
+    """Return search params matching the collection's index metric and type"""
+    if collection.name not in _search_params:
+        index = collection.index().params
+        params = {"metric_type": index.get('metric_type', 'IP')}
+        if index.get('index_type') == 'IVF_FLAT':
+            params["params"] = {"nprobe": 16}
+        _search_params[collection.name] = params
+    return _search_params[collection.name]
+
+class BulkInsertUnresolved(Exception):
+    """Bulk insert outcome is unknown or couldn't be rolled back, so falling back could duplicate rows"""
+
+def delete_chunks_by_id(ids):
+    """Remove chunks by primary key, e.g. the rows of a partially failed ingest"""
+    if ids:
+        collection.delete(f"id in {[int(i) for i in ids]}")
+
+def wait_for_bulk_insert(task_ids, timeout=BULK_INSERT_TIMEOUT):
+    """Poll bulk insert tasks until all have completed or failed and return their final states"""
+    deadline = time.time() + timeout
+    finished = {}
+    while len(finished) < len(task_ids):
+        for task_id in task_ids:
+            if task_id in finished:
+                continue
+            state = utility.get_bulk_insert_state(task_id=task_id)
+            if state.state in (BulkInsertState.ImportCompleted, BulkInsertState.ImportFailed,
+                               BulkInsertState.ImportFailedAndCleaned):
+                finished[task_id] = state
+        if len(finished) < len(task_ids):
+            if time.time() >= deadline:
+                pending = sorted(set(task_ids) - set(finished))
+                raise BulkInsertUnresolved(f"Bulk insert tasks {pending} did not finish in {timeout}s")
+            time.sleep(1)
+    return finished
+
+def bulk_insert_chunks(key, chunks, embeddings):
+    """Write chunks to Parquet, upload them to Milvus object storage and wait for the import.
+
+    If any task fails, rows imported by the other tasks are deleted by id before raising;
+    Milvus itself discards the rows of failed tasks."""
+    bulk_writer = lazy_import('pymilvus.bulk_writer')
+    # LocalBulkWriter creates a uuid subdirectory here but not the parent itself
+    os.makedirs(BULK_WRITER_DIR, exist_ok=True)
+    writer = bulk_writer.LocalBulkWriter(
+        schema=collection.schema,
+        local_path=BULK_WRITER_DIR,
+        file_type=bulk_writer.BulkFileType.PARQUET,
+    )
+    task_ids = []
+    submit_error = None
+    try:
+        for embedding, text in zip(embeddings, chunks):
+            writer.append_row({'embeddings': embedding, 'text': text, 'doc_key': key})
+        writer.commit()
+        # The writer logs flush errors on its worker thread instead of raising them
+        if not writer.batch_files:
+            raise RuntimeError("Bulk writer produced no files")
+
+        for batch in writer.batch_files:
+            s3_keys = []
+            for local_file in batch:
+                s3_key = f"bulk_insert/{os.path.relpath(local_file, BULK_WRITER_DIR)}"
+                s3.upload_file(local_file, MILVUS_BULK_BUCKET, s3_key)
+                s3_keys.append(s3_key)
+            task_ids.append(utility.do_bulk_insert(collection_name=collection.name, files=s3_keys))
+    except Exception as e:
+        if not task_ids:
+            raise
+        # Earlier batches were already submitted; wait for them so they can be rolled back
+        submit_error = e
+    finally:
+        shutil.rmtree(writer.data_path, ignore_errors=True)
+
+    print(f"Started Milvus bulk insert for {len(chunks)} chunks of {key}: tasks {task_ids}")
+    states = wait_for_bulk_insert(task_ids)
+    failed = {task_id: state for task_id, state in states.items()
+              if state.state != BulkInsertState.ImportCompleted}
+    if failed or submit_error:
+        completed = [state for state in states.values() if state.state == BulkInsertState.ImportCompleted]
+        imported_ids = [i for state in completed for i in state.ids]
+        if completed and not imported_ids:
+            raise BulkInsertUnresolved(f"Bulk insert tasks {sorted(states)} partially completed without reporting ids")
+        delete_chunks_by_id(imported_ids)
+        reasons = '; '.join(f"task {task_id}: {state.failed_reason}" for task_id, state in failed.items())
+        raise RuntimeError(f"Bulk insert failed ({reasons or submit_error})")
+    return task_ids
+
+def extract_pdf_text(path):
+    """Extract text from all pages of a PDF file, splitting contiguous page ranges across threads.
+    The file is memory-mapped so pages are read from the page cache instead of copied onto the heap."""
+    PyPDF2 = lazy_import('PyPDF2')
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as first_map:
+        first_reader = PyPDF2.PdfReader(first_map)
+        page_count = len(first_reader.pages)
+        pages_per_worker = max(1, -(-page_count // PDF_EXTRACT_WORKERS))
+        # Only start as many workers as there are non-empty page ranges
+        workers = max(1, -(-page_count // pages_per_worker))
+
+        def read_range(reader, worker):
+            start = worker * pages_per_worker
+            buffer = io.StringIO()
+            for i in range(start, min(start + pages_per_worker, page_count)):
+                buffer.write(reader.pages[i].extract_text() or '')
+            return buffer.getvalue()
+
+        def extract_range(worker):
+            if worker == 0:
+                return read_range(first_reader, worker)
+            # PdfReader seeks its stream lazily and isn't thread-safe, so each worker maps the file itself
+            with open(path, 'rb') as worker_file, \
+                    mmap.mmap(worker_file.fileno(), 0, access=mmap.ACCESS_READ) as worker_map:
+                return read_range(PyPDF2.PdfReader(worker_map), worker)
+
+        if workers == 1:
+            return extract_range(0)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return ''.join(executor.map(extract_range, range(workers)))
+
+# Use a bundled tiktoken cache if one was packaged with the function (see README)
+_bundled_tiktoken_cache = pathlib.Path(__file__).parent / 'tiktoken_cache'
+if _bundled_tiktoken_cache.is_dir():
+    os.environ.setdefault('TIKTOKEN_CACHE_DIR', str(_bundled_tiktoken_cache))
+
+_tokenizer = None
+
+def get_tokenizer():
+    """Return the shared tiktoken encoding. tiktoken downloads its BPE file on first load
+    unless TIKTOKEN_CACHE_DIR already holds it, so init() loads it outside the request path."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = lazy_import('tiktoken').encoding_for_model("text-embedding-3-small")
+    return _tokenizer
+
+def _char_boundary(ids, index, direction):
+    """Move a token index in the given direction until the token there starts a UTF-8 character.
+    Byte-level tokens can split multi-byte characters, e.g. Estonian umlauts or CJK text."""
+    tokenizer = get_tokenizer()
+    while 0 < index < len(ids) and (tokenizer.decode_single_token_bytes(ids[index])[0] & 0xC0) == 0x80:
+        index += direction
+    return index
+
+def split_text(text, chunk_tokens=None, overlap_tokens=None):
+    """Split text into overlapping windows of chunk_tokens tokens (default CHUNK_TOKENS) in a single linear pass.
+    Window edges are moved to character boundaries so no chunk starts or ends mid-character."""
+    chunk_tokens = CHUNK_TOKENS if chunk_tokens is None else chunk_tokens
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError(f"Chunk overlap ({overlap_tokens}) must be non-negative and smaller than chunk size ({chunk_tokens})")
+    tokenizer = get_tokenizer()
+    ids = tokenizer.encode(text)
+    step = chunk_tokens - overlap_tokens
+    chunks = []
+    for window_start in range(0, max(len(ids) - overlap_tokens, 1), step):
+        start = _char_boundary(ids, window_start, 1)
+        end = _char_boundary(ids, min(window_start + chunk_tokens, len(ids)), -1)
+        if start < end:
+            chunks.append(tokenizer.decode(ids[start:end]))
+    return chunks
+
+def stream_insert_chunks(key, chunks):
+    """Embed and insert chunks in batches, inserting each batch while the next one is embedded"""
+    batches = queue.Queue(maxsize=2)
+    errors = []
+    inserted_ids = []
+
+    def insert_worker():
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            # After a failure keep draining the queue so the producer never blocks
+            if errors:
+                continue
+            batch_chunks, vectors = item
+            try:
+                # The id field is auto_id, so only (embeddings, text, doc_key) columns are sent
+                result = collection.insert([vectors, batch_chunks, [key]*len(batch_chunks)])
+                inserted_ids.extend(result.primary_keys)
+            except Exception as e:
+                errors.append(e)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            inserter = executor.submit(insert_worker)
+            try:
+                for start in range(0, len(chunks), INSERT_BATCH_SIZE):
+                    if errors:
+                        break
+                    batch_chunks = chunks[start:start + INSERT_BATCH_SIZE]
+                    batches.put((batch_chunks, as_vectors(cached_embed(batch_chunks))))
+            finally:
+                batches.put(None)
+            inserter.result()
+        if errors:
+            raise errors[0]
+    except Exception:
+        # Remove only the rows this run inserted so a retry doesn't duplicate them;
+        # an earlier upload of the same key stays intact
+        try:
+            delete_chunks_by_id(inserted_ids)
+        except Exception as e:
+            print(f"Error removing partially inserted chunks of {key}: {str(e)}")
+        raise
+    # Seal the inserted segments once, after all batches
+    collection.flush()
+
 def process_pdf(bucket, key):
     if not collection or not embedder:
         print("ERROR: Cannot process PDF without Milvus collection and embeddings model")
         return False
         
     try:
-        pdf_file = s3.get_object(Bucket=bucket, Key=key)['Body']
-        text = ''.join(PyPDF2.PdfReader(pdf_file).pages[i].extract_text() for i in range(len(PyPDF2.PdfReader(pdf_file).pages)))
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = splitter.split_text(text)
-        embeddings = embedder.embed_documents(chunks)
-        collection.insert([[i for i in range(len(chunks))], embeddings, chunks, [key]*len(chunks)])
+        # Download to ephemeral storage rather than holding the whole object in memory
+        pdf_path = f"/tmp/{hashlib.sha256(key.encode()).hexdigest()[:16]}.pdf"
+        s3.download_file(bucket, key, pdf_path)
+        try:
+            # Drop form feeds so they don't inflate chunk token counts
+            text = extract_pdf_text(pdf_path).replace('\f', '')
+        finally:
+            os.remove(pdf_path)
+        chunks = split_text(text)
+        if len(chunks) > BULK_INSERT_THRESHOLD and MILVUS_BULK_BUCKET:
+            try:
+                bulk_insert_chunks(key, chunks, as_vectors(cached_embed(chunks)))
+                return True
+            except BulkInsertUnresolved:
+                # Some rows may still be imported, so falling back could duplicate chunks
+                raise
+            except Exception as e:
+                # Rows of failed tasks are discarded by Milvus and completed ones were rolled back
+                print(f"Bulk insert failed, falling back to streaming insert: {str(e)}")
+        stream_insert_chunks(key, chunks)
         return True
     except Exception as e:
         print(f"Error processing PDF: {str(e)}")
@@ -212,10 +742,10 @@ def speech_to_text(audio_data):
         return None
         
     try:
-        with open('/tmp/audio.wav', 'wb') as f:
-            f.write(bytes.fromhex(audio_data))
-        with open('/tmp/audio.wav', 'rb') as f:
-            transcript = openai_client.audio.transcriptions.create(model='whisper-1', file=f, language='et')
+        # Audio arrives base64-encoded; the name tells the API which format it is
+        audio_file = io.BytesIO(base64.b64decode(audio_data))
+        audio_file.name = 'audio.wav'
+        transcript = openai_client.audio.transcriptions.create(model='whisper-1', file=audio_file, language='et')
         return transcript.text
     except Exception as e:
         print(f"Error in speech-to-text: {str(e)}")
@@ -227,11 +757,12 @@ def text_to_speech(text):
         return None
         
     try:
+        texttospeech = lazy_import('google.cloud.texttospeech')
         synthesis_input = texttospeech.SynthesisInput(text=text)
         voice = texttospeech.VoiceSelectionParams(language_code='et-EE', name='et-EE-Wavenet-A')
         audio_config = texttospeech.AudioConfig(audio_encoding='MP3')
         response = google_tts.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
-        return response.audio_content.hex()
+        return base64.b64encode(response.audio_content).decode()
     except Exception as e:
         print(f"Error in text-to-speech: {str(e)}")
         return None
@@ -240,9 +771,6 @@ def health_check():
     """Health check endpoint following our established pattern"""
     # Always return a 200 status code for health checks
     # Add detailed component status for troubleshooting
-    embedding_type = "HuggingFace" if isinstance(embedder, HuggingFaceEmbeddings) else \
-                     "OpenAI fallback" if embedder else "None"
-    
     status = {
         "service": "largo-chat-lambda",
         "status": "healthy",
@@ -264,7 +792,7 @@ def main(event, context):
     # Always start HTTP server before attempting connections
     # This follows our resilient application startup pattern
     
-    # Initialize on first invocation
+    # Retry initialization if it did not complete during the INIT phase
     if not is_initialized:
         init()
     
@@ -272,39 +800,39 @@ def main(event, context):
     if event.get('path') == '/health' and event.get('httpMethod') == 'GET':
         return {
             'statusCode': 200,
-            'body': json.dumps(health_check())
+            'body': orjson.dumps(health_check()).decode()
         }
     
     # Process actual requests
     try:
-        body = json.loads(event.get('body', '{}'))
+        body = orjson.loads(event.get('body') or '{}')
         
         # Content Upload
         if 's3_upload' in body:
             if process_pdf(os.getenv('BUCKET_NAME'), body['s3_upload']):
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Content processed'})}
+                return {'statusCode': 200, 'body': orjson.dumps({'message': 'Content processed'}).decode()}
             else:
-                return {'statusCode': 500, 'body': json.dumps({'error': 'Failed to process content'})}
+                return {'statusCode': 500, 'body': orjson.dumps({'error': 'Failed to process content'}).decode()}
         
         # STT
         if 'audio' in body:
             text = speech_to_text(body['audio'])
             if text:
-                return {'statusCode': 200, 'body': json.dumps({'text': text})}
+                return {'statusCode': 200, 'body': orjson.dumps({'text': text}).decode()}
             else:
-                return {'statusCode': 500, 'body': json.dumps({'error': 'Speech-to-text failed'})}
+                return {'statusCode': 500, 'body': orjson.dumps({'error': 'Speech-to-text failed'}).decode()}
         
         # Chat or TTS
         if 'query' in body:
             if not collection or not embedder:
-                return {'statusCode': 503, 'body': json.dumps({
+                return {'statusCode': 503, 'body': orjson.dumps({
                     'error': 'Service not fully initialized', 
                     'details': 'Vector search capabilities unavailable'
-                })}
+                }).decode()}
                 
             try:
                 query_embedding = embedder.embed_query(body['query'])
-                results = collection.search([query_embedding], 'embeddings', {"metric_type": "L2"}, limit=5)
+                results = collection.search(as_vectors([query_embedding]), 'embeddings', search_params(), limit=5)
                 context_docs = [hit.entity.get('text') for hit in results[0]]
                 
                 prompt = f"Based only on this context:\n{''.join(context_docs)}\nGenerate a 50-word pitch if asked to present capabilities, else answer: {body['query']}"
@@ -314,18 +842,18 @@ def main(event, context):
                 if body.get('to_speech'):
                     audio = text_to_speech(text)
                     if audio:
-                        return {'statusCode': 200, 'body': json.dumps({'text': text, 'audio': audio})}
+                        return {'statusCode': 200, 'body': orjson.dumps({'text': text, 'audio': audio}).decode()}
                     else:
-                        return {'statusCode': 200, 'body': json.dumps({'text': text, 'error': 'Text-to-speech failed'})}
+                        return {'statusCode': 200, 'body': orjson.dumps({'text': text, 'error': 'Text-to-speech failed'}).decode()}
                         
-                return {'statusCode': 200, 'body': json.dumps({'text': text})}
+                return {'statusCode': 200, 'body': orjson.dumps({'text': text}).decode()}
             except Exception as e:
-                return {'statusCode': 500, 'body': json.dumps({'error': f'Query processing error: {str(e)}'})}
+                return {'statusCode': 500, 'body': orjson.dumps({'error': f'Query processing error: {str(e)}'}).decode()}
             
-        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid request'})}
+        return {'statusCode': 400, 'body': orjson.dumps({'error': 'Invalid request'}).decode()}
     except Exception as e:
         print(f"Error processing request: {str(e)}")
-        return {'statusCode': 500, 'body': json.dumps({'error': f'Internal error: {str(e)}'})}
+        return {'statusCode': 500, 'body': orjson.dumps({'error': f'Internal error: {str(e)}'}).decode()}
 
 # For local development
 class LocalServer(http.server.SimpleHTTPRequestHandler):
@@ -334,7 +862,7 @@ class LocalServer(http.server.SimpleHTTPRequestHandler):
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps(health_check()).encode())
+            self.wfile.write(orjson.dumps(health_check()))
         else:
             self.send_response(404)
             self.end_headers()
@@ -413,6 +941,14 @@ def graceful_shutdown(sig, frame):
         pass
     sys.exit(0)
 
+# In Lambda, initialize during the INIT phase so the first request doesn't pay for it.
+# main() still retries init() if this fails.
+if os.getenv('AWS_LAMBDA_FUNCTION_NAME'):
+    try:
+        init()
+    except Exception as e:
+        print(f"Error during Lambda INIT phase initialization: {str(e)}")
+
 # Entry point for CLI
 if __name__ == "__main__":
     # Set up signal handling for graceful shutdown
@@ -1,5 +1,6 @@
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
 import os
+import math
 import time
 import pathlib
 from dotenv import load_dotenv
@@ -10,7 +11,44 @@ if env_path.exists():
     print(f"Loading environment from {env_path}")
     load_dotenv(dotenv_path=env_path)
 
-def create_milvus_collection(host='localhost', port='19530', collection_name='docs'):
+# Below this many vectors IVF_FLAT builds much faster than HNSW and searches fast enough
+HNSW_MIN_SIZE = 50000
+
+def index_params(expected_size):
+    """Choose index params for the expected number of vectors"""
+    if expected_size < HNSW_MIN_SIZE:
+        return {
+            "index_type": "IVF_FLAT",
+            "metric_type": "IP",
+            "params": {"nlist": max(16, int(math.sqrt(expected_size)))}
+        }
+    return {
+        "index_type": "HNSW",
+        "metric_type": "IP",  # Vectors are L2-normalized, so IP ranks like cosine
+        "params": {"M": 16, "efConstruction": 200}
+    }
+
+def docs_schema():
+    """Schema of the chatbot documents collection"""
+    fields = [
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
+        # bge-base-en dim, stored as fp16 to halve storage and transfer size
+        FieldSchema(name='embeddings', dtype=DataType.FLOAT16_VECTOR, dim=768),
+        FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=65535),
+        FieldSchema(name='doc_key', dtype=DataType.VARCHAR, max_length=255),
+    ]
+    return CollectionSchema(fields=fields, description='Chatbot documents')
+
+def ensure_connection(host='localhost', port='19530', alias='default'):
+    """Connect to Milvus unless a connection under this alias already exists.
+
+    An existing connection is reused as-is: host and port are only used for the first
+    connect on an alias, so connecting to a different server requires a different alias."""
+    if not connections.has_connection(alias):
+        # keep_alive makes pymilvus reconnect a channel that went idle, e.g. in a frozen warm container
+        connections.connect(alias=alias, host=host, port=port, keep_alive=True)
+
+def create_milvus_collection(host='localhost', port='19530', collection_name='docs', expected_size=10000):
     """Create Milvus collection with retry logic"""
     max_retries = 5
     retry_delay = 3  # seconds
@@ -19,7 +57,7 @@ def create_milvus_collection(host='localhost', port='19530', collection_name='do
         try:
             # Connect to Milvus
             print(f"Connecting to Milvus at {host}:{port} (attempt {attempt+1}/{max_retries})")
-            connections.connect(host=host, port=port)
+            ensure_connection(host, port)
             
             # Check if collection exists
             if utility.has_collection(collection_name):
@@ -27,26 +65,13 @@ def create_milvus_collection(host='localhost', port='19530', collection_name='do
                 collection = Collection(collection_name)
                 return collection
             
-            # Define schema
-            fields = [
-                FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name='embeddings', dtype=DataType.FLOAT_VECTOR, dim=768),  # bge-base-en dim
-                FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=65535),
-                FieldSchema(name='doc_key', dtype=DataType.VARCHAR, max_length=255),
-            ]
-            schema = CollectionSchema(fields=fields, description='Chatbot documents')
-            
             # Create collection
             print(f"Creating collection '{collection_name}'")
-            collection = Collection(collection_name, schema)
+            collection = Collection(collection_name, docs_schema())
             
             # Create index
             print("Creating vector index (this may take a while for large collections)")
-            collection.create_index('embeddings', {
-                "index_type": "HNSW", 
-                "metric_type": "L2", 
-                "params": {"M": 16, "efConstruction": 200}
-            })
+            collection.create_index('embeddings', index_params(expected_size))
             
             print(f"Collection '{collection_name}' created and indexed successfully")
             return collection
@@ -64,9 +89,10 @@ if __name__ == "__main__":
     # Get connection details from environment
     host = os.getenv('MILVUS_HOST', 'localhost')
     port = os.getenv('MILVUS_PORT', '19530')
+    expected_size = int(os.getenv('MILVUS_EXPECTED_SIZE', 10000))
     
     try:
-        create_milvus_collection(host, port)
+        create_milvus_collection(host, port, expected_size=expected_size)
         print("Milvus setup completed successfully")
     except Exception as e:
         print(f"Milvus setup failed: {str(e)}")
\ No newline at end of file
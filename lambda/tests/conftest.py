@@ -0,0 +1,10 @@
+import os
+import pathlib
+import sys
+
+# handler.py and milvus_setup.py are top-level modules in the lambda directory
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# boto3 clients are created at import time and need a region; keep init() out of the import
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.pop('AWS_LAMBDA_FUNCTION_NAME', None)
@@ -0,0 +1,268 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pymilvus import BulkInsertState
+
+import handler
+
+
+class FakeTokenizer:
+    """Byte-level tokenizer: one token per UTF-8 byte, decoded the way tiktoken does"""
+    def encode(self, text):
+        return list(text.encode())
+
+    def decode(self, ids):
+        return bytes(ids).decode(errors='replace')
+
+    def decode_single_token_bytes(self, token):
+        return bytes([token])
+
+
+class FakeEmbedder:
+    model_name = "fake-model"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 2.0] for text in texts]
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    monkeypatch.setattr(handler, '_tokenizer', FakeTokenizer())
+
+
+@pytest.fixture
+def embedder(monkeypatch, tmp_path):
+    fake = FakeEmbedder()
+    monkeypatch.setattr(handler, 'embedder', fake)
+    monkeypatch.setattr(handler, 'EMBEDDING_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(handler, 'EMBEDDING_CACHE_PREFIX', None)
+    return fake
+
+
+def tokens(n):
+    return ''.join(chr(ord('!') + i % 90) for i in range(n))
+
+
+@pytest.mark.parametrize("length, expected", [
+    (0, []),
+    (256, [(0, 256)]),
+    (257, [(0, 256), (206, 257)]),
+    (463, [(0, 256), (206, 462), (412, 463)]),
+])
+def test_split_text_window_boundaries(tokenizer, length, expected):
+    text = tokens(length)
+    chunks = handler.split_text(text, chunk_tokens=256, overlap_tokens=50)
+    assert chunks == [text[start:end] for start, end in expected]
+
+
+@pytest.mark.parametrize("text", ['ä' * 300, 'õun ' * 100, '漢字' * 150])
+def test_split_text_never_splits_multibyte_characters(tokenizer, text):
+    chunks = handler.split_text(text, chunk_tokens=25, overlap_tokens=6)
+    assert len(chunks) > 1
+    assert all('\ufffd' not in chunk for chunk in chunks)
+    assert all(chunk in text for chunk in chunks)
+    # Windows still cover the whole text
+    assert text.startswith(chunks[0]) and text.endswith(chunks[-1])
+
+
+def test_split_text_rejects_overlap_not_smaller_than_chunk(tokenizer):
+    with pytest.raises(ValueError, match="overlap"):
+        handler.split_text(tokens(10), chunk_tokens=4, overlap_tokens=4)
+    with pytest.raises(ValueError, match="overlap"):
+        handler.split_text(tokens(10), chunk_tokens=4, overlap_tokens=5)
+
+
+def test_batch_texts_packs_greedily_in_order(monkeypatch):
+    monkeypatch.setattr(handler, 'BATCH_TOKENS', 10)
+    texts = ['a' * 16, 'b' * 16, 'c' * 8, 'd' * 40, 'e' * 4]  # 4, 4, 2, 10, 1 estimated tokens
+    batches = handler.DummyEmbedder._batch_texts(texts)
+    assert batches == [['a' * 16, 'b' * 16, 'c' * 8], ['d' * 40], ['e' * 4]]
+    assert [text for batch in batches for text in batch] == texts
+
+
+def test_batch_texts_keeps_oversized_text_in_its_own_batch(monkeypatch):
+    monkeypatch.setattr(handler, 'BATCH_TOKENS', 10)
+    assert handler.DummyEmbedder._batch_texts(['x' * 100, 'y']) == [['x' * 100], ['y']]
+    assert handler.DummyEmbedder._batch_texts([]) == []
+
+
+def test_cached_embed_merges_hits_and_misses_in_order(embedder):
+    first = handler.cached_embed(['a', 'bb'])
+    assert embedder.calls == [['a', 'bb']]
+    np.testing.assert_array_equal(first, [[1, 1, 2], [2, 1, 2]])
+
+    second = handler.cached_embed(['bb', 'ccc', 'a'])
+    assert embedder.calls[1:] == [['ccc']]
+    assert second.dtype == np.float32
+    np.testing.assert_array_equal(second, [[2, 1, 2], [3, 1, 2], [1, 1, 2]])
+
+
+def test_cached_embed_all_hits_skips_embedder(embedder):
+    handler.cached_embed(['a', 'bb'])
+    result = handler.cached_embed(['bb', 'a'])
+    assert len(embedder.calls) == 1
+    np.testing.assert_array_equal(result, [[2, 1, 2], [1, 1, 2]])
+
+
+def test_cached_embed_keys_include_model_name(embedder, monkeypatch):
+    handler.cached_embed(['a'])
+    monkeypatch.setattr(embedder, 'model_name', 'other-model')
+    handler.cached_embed(['a'])
+    assert embedder.calls == [['a'], ['a']]
+
+
+def test_cached_embed_empty(embedder):
+    assert handler.cached_embed([]).shape == (0, 0)
+    assert embedder.calls == []
+
+
+def test_prune_embedding_cache_removes_oldest_entries(embedder):
+    for age, name in enumerate(['newest', 'middle', 'oldest']):
+        path = handler._store_cached_embedding(name, [1.0, 2.0, 3.0])
+        os.utime(path, (1000 - age, 1000 - age))
+    size = os.path.getsize(path)
+
+    assert handler._prune_embedding_cache(max_bytes=3 * size) == 0
+    assert handler._prune_embedding_cache(max_bytes=2 * size) == 1
+    assert sorted(os.listdir(handler.EMBEDDING_CACHE_DIR)) == ['middle.npy', 'newest.npy']
+
+
+def test_cached_embed_prunes_past_max_size(embedder, monkeypatch):
+    monkeypatch.setattr(handler, 'EMBEDDING_CACHE_MAX_MB', 0)
+    handler.cached_embed(['a', 'bb'])
+    assert os.listdir(handler.EMBEDDING_CACHE_DIR) == []
+
+
+def test_load_cached_batch_logs_access_denied_once(monkeypatch, capsys):
+    error = handler.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'GetObject')
+
+    def get_object(**kwargs):
+        raise error
+
+    monkeypatch.setattr(handler, 's3', SimpleNamespace(get_object=get_object))
+    monkeypatch.setattr(handler, '_cache_access_denied_logged', False)
+    assert handler._load_cached_batch('bucket', 'a') == {}
+    assert handler._load_cached_batch('bucket', 'b') == {}
+    assert capsys.readouterr().out.count('Embedding cache read denied') == 1
+
+
+def test_bulk_insert_chunks_writes_float16_parquet(monkeypatch, tmp_path):
+    pytest.importorskip('pymilvus.bulk_writer')
+    import pyarrow.parquet as pq
+    from milvus_setup import docs_schema
+
+    bulk_dir = tmp_path / 'bulk_writer'  # not created yet, like /tmp/bulk_writer on a fresh container
+    monkeypatch.setattr(handler, 'BULK_WRITER_DIR', str(bulk_dir))
+    monkeypatch.setattr(handler, 'MILVUS_BULK_BUCKET', 'milvus-bucket')
+    monkeypatch.setattr(handler, 'collection', SimpleNamespace(schema=docs_schema(), name='docs'))
+
+    uploads = []
+
+    def upload_file(local_file, bucket, s3_key):
+        uploads.append((bucket, s3_key, pq.read_table(local_file)))
+
+    monkeypatch.setattr(handler, 's3', SimpleNamespace(upload_file=upload_file))
+    submitted = []
+    monkeypatch.setattr(handler, 'utility', SimpleNamespace(
+        do_bulk_insert=lambda collection_name, files: submitted.append((collection_name, files)) or 7))
+    monkeypatch.setattr(handler, 'wait_for_bulk_insert',
+                        lambda task_ids: {t: SimpleNamespace(state=BulkInsertState.ImportCompleted) for t in task_ids})
+
+    chunks = ['first', 'second', 'third']
+    vectors = handler.as_vectors(np.random.default_rng(0).random((3, 768)))
+    assert vectors[0].dtype == np.float16
+
+    assert handler.bulk_insert_chunks('doc.pdf', chunks, vectors) == [7]
+
+    assert len(uploads) == 1
+    bucket, s3_key, table = uploads[0]
+    assert bucket == 'milvus-bucket'
+    assert s3_key.startswith('bulk_insert/') and s3_key.endswith('.parquet')
+    assert submitted == [('docs', [s3_key])]
+    assert table.column('text').to_pylist() == chunks
+    assert table.column('doc_key').to_pylist() == ['doc.pdf'] * 3
+    # Local Parquet files are removed once uploaded
+    assert list(bulk_dir.iterdir()) == []
+
+
+class FakeBulkWriter:
+    """Stands in for LocalBulkWriter, producing one file batch per pair of rows"""
+    def __init__(self, schema, local_path, file_type):
+        self.data_path = os.path.join(local_path, 'run')
+        self.rows = []
+
+    def append_row(self, row):
+        self.rows.append(row)
+
+    def commit(self):
+        self.batch_files = [[os.path.join(self.data_path, str(i), 'part.parquet')]
+                            for i in range(0, len(self.rows), 2)]
+
+
+@pytest.fixture
+def fake_bulk(monkeypatch, tmp_path):
+    deleted = []
+    monkeypatch.setattr(handler, 'BULK_WRITER_DIR', str(tmp_path))
+    monkeypatch.setattr(handler, 'lazy_import', lambda name: SimpleNamespace(
+        LocalBulkWriter=FakeBulkWriter, BulkFileType=SimpleNamespace(PARQUET='parquet')))
+    monkeypatch.setattr(handler, 's3', SimpleNamespace(upload_file=lambda *args: None))
+    monkeypatch.setattr(handler, 'collection', SimpleNamespace(schema=None, name='docs', delete=deleted.append))
+    return deleted
+
+
+def test_bulk_insert_rolls_back_completed_tasks_when_one_fails(monkeypatch, fake_bulk):
+    states = {
+        0: SimpleNamespace(state=BulkInsertState.ImportCompleted, ids=[10, 11], failed_reason=''),
+        1: SimpleNamespace(state=BulkInsertState.ImportFailedAndCleaned, ids=[], failed_reason='bad row'),
+    }
+    task_ids = iter(states)
+    monkeypatch.setattr(handler, 'utility', SimpleNamespace(
+        do_bulk_insert=lambda collection_name, files: next(task_ids),
+        get_bulk_insert_state=lambda task_id: states[task_id]))
+
+    with pytest.raises(RuntimeError, match='bad row'):
+        handler.bulk_insert_chunks('doc.pdf', ['a', 'b', 'c', 'd'], [None] * 4)
+    # Only the rows imported by this run are removed, never the whole doc_key
+    assert fake_bulk == ['id in [10, 11]']
+
+
+def test_bulk_insert_unresolved_when_completed_ids_unknown(monkeypatch, fake_bulk):
+    states = {
+        0: SimpleNamespace(state=BulkInsertState.ImportCompleted, ids=[], failed_reason=''),
+        1: SimpleNamespace(state=BulkInsertState.ImportFailed, ids=[], failed_reason='bad row'),
+    }
+    task_ids = iter(states)
+    monkeypatch.setattr(handler, 'utility', SimpleNamespace(
+        do_bulk_insert=lambda collection_name, files: next(task_ids),
+        get_bulk_insert_state=lambda task_id: states[task_id]))
+
+    with pytest.raises(handler.BulkInsertUnresolved):
+        handler.bulk_insert_chunks('doc.pdf', ['a', 'b', 'c', 'd'], [None] * 4)
+    assert fake_bulk == []
+
+
+def test_stream_insert_rolls_back_only_inserted_rows(monkeypatch):
+    deleted = []
+    inserts = []
+
+    def insert(columns):
+        inserts.append(columns[1])
+        if len(inserts) == 3:
+            raise RuntimeError('insert failed')
+        start = 100 * len(inserts)
+        return SimpleNamespace(primary_keys=list(range(start, start + len(columns[1]))))
+
+    monkeypatch.setattr(handler, 'collection', SimpleNamespace(insert=insert, delete=deleted.append))
+    monkeypatch.setattr(handler, 'INSERT_BATCH_SIZE', 2)
+    monkeypatch.setattr(handler, 'cached_embed', lambda chunks: np.ones((len(chunks), 3), dtype=np.float32))
+    monkeypatch.setattr(handler, 'as_vectors', list)
+
+    with pytest.raises(RuntimeError, match='insert failed'):
+        handler.stream_insert_chunks('doc.pdf', ['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+    assert deleted == ['id in [100, 101, 200, 201]']
@@ -28,7 +28,7 @@ fi
 echo "Creating deployment package..."
 cd $LAMBDA_DIR
 rm -f ../lambda-deploy.zip
-zip -r ../lambda-deploy.zip . -x "*.git*" "*.env*" "*__pycache__*" "*.pytest_cache*" "node_modules/*"
+zip -r ../lambda-deploy.zip . -x "*.git*" "*.env*" "*__pycache__*" "*.pytest_cache*" "tests/*" "node_modules/*"
 cd ..
 
 # Update the Lambda function